@@ -1,11 +1,20 @@
-from typing import Any, Dict, List, Text
+from typing import Any, Dict, List, Optional, Text, Tuple
+import asyncio
+import atexit
+import logging
 import os
+import queue
 import re
+import threading
 import time
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from types import MappingProxyType
 
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from rasa_sdk import Action, Tracker
 from rasa_sdk.events import SlotSet, FollowupAction, Restarted
@@ -17,12 +26,102 @@ try:
 except ImportError:  # pragma: no cover
     litellm = None
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Lookup tables shared by the mood/support actions. Read-only views, since the
+# action server may run several conversations concurrently.
+_INTENT_TO_MOOD = MappingProxyType({
+    "mood_happy": "happy",
+    "mood_sad": "sad",
+    "mood_angry": "angry",
+})
+
+_MOOD_KEYS = frozenset(_INTENT_TO_MOOD.values())
+
+# (support_completed, mood) -> response sent by action_start_reflect_flow. Right
+# after the support flow we follow up on the mood instead of reflecting it anew.
+# Sad and angry responses already include the "do you know why" question.
+_REFLECT_TABLE = MappingProxyType({
+    (False, "happy"): "utter_reflect_mood_happy",
+    (False, "sad"): "utter_reflect_mood_sad_with_reason",
+    (False, "angry"): "utter_reflect_mood_angry_with_reason",
+    (True, "happy"): "utter_followup_mood_happy",
+    (True, "sad"): "utter_followup_mood_sad_with_reason",
+    (True, "angry"): "utter_followup_mood_angry_with_reason",
+})
+
+_MOOD_INTENTS = frozenset(_INTENT_TO_MOOD)
+_AFFIRM_DENY = frozenset({"affirm", "deny"})
+
+# Reason codes (button payloads) -> friendlier phrasing for conversation.
+_REASON_FRIENDLY = MappingProxyType({
+    "tired": "being tired",
+    "missing_someone": "missing someone",
+    "change_in_routine": "something changed at home",
+    "worry_school": "worrying about school",
+    "dont_know": "not sure",
+    "frustration": "feeling frustrated",
+    "someone_bothered_me": "someone upset you",
+    "feeling_ignored": "feeling ignored",
+    "overstimulation": "a noisy or overwhelming place",
+})
+
+# Reasons (button code or casefolded typed text, with typographic apostrophes
+# folded to ASCII) meaning the user doesn't know.
+_UNKNOWN_REASONS = frozenset({
+    "dont_know",
+    "i don't know",
+    "i dont know",
+    "i'm not sure",
+    "im not sure",
+    "not sure",
+    "idk",
+    "dunno",
+})
+
+# Shown when the user declines to continue at each support stage.
+_PAUSE_MSG_COMMON = "No worries — we can pause here. If you want to try later, I’ll be here."
+_PAUSE_MSG_ACCEPTANCE = (
+    "That's okay. We can pause anytime. If you want to continue later, tell me and we can pick it up."
+)
+_PAUSE_MSG_ANALYSIS = "Totally fine — we can stop here for now."
+_PAUSE_MSG_NUANCE = "That’s okay — if you want to keep exploring another time, I’ll be right here."
+
+# support_stage -> (utterance for that stage, next stage on affirm, pause text on deny).
+# A next stage of None marks the final step of the support flow.
+_STAGE_TABLE = MappingProxyType({
+    "common_ground": ("utter_stage_common_ground_with_question", "acceptance", _PAUSE_MSG_COMMON),
+    "acceptance": ("utter_stage_acceptance_with_question", "analysis", _PAUSE_MSG_ACCEPTANCE),
+    "analysis": ("utter_stage_analysis_with_question", "nuance", _PAUSE_MSG_ANALYSIS),
+    "nuance": ("utter_stage_nuance_with_question", None, _PAUSE_MSG_NUANCE),
+})
+
+_EMPTY = MappingProxyType({})
+
 
 def _has_user_text(tracker: Tracker) -> bool:
-    text = (tracker.latest_message.get("text") or "").strip()
-    return bool(text)
+    text = tracker.latest_message.get("text")
+    # isspace() is False for "" so this checks for any non-whitespace character
+    # without allocating a stripped copy.
+    return bool(text) and not text.isspace()
+
+
+def _reset_support_events(*extra_slots: Text) -> List[Dict[Text, Any]]:
+    """SlotSet events clearing support_stage, reason and any extra slots."""
+    return [SlotSet(name, None) for name in ("support_stage", "reason", *extra_slots)]
+
+
+def _intent_and_text(tracker: Tracker) -> Tuple[Optional[Text], Text]:
+    """Return the latest intent name and the stripped user text in one pass."""
+    message = tracker.latest_message
+    return (message.get("intent") or _EMPTY).get("name"), (message.get("text") or "").strip()
 
 
 
@@ -31,7 +130,7 @@ class ActionCheckSufficientFunds(Action):
     def name(self) -> Text:
         return "action_check_sufficient_funds"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -51,111 +150,79 @@ class ActionStartReflectFlow(Action):
     def name(self) -> str:
         return "action_start_reflect_flow"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
         domain: Dict[str, Any],
     ) -> List[Dict[str, Any]]:
         """Dispatch the correct reflection utterance based on the mood slot."""
-        if not _has_user_text(tracker):
-            return []
         # Determine current intent and handle mood selection
-        intent = tracker.latest_message.get("intent", {}).get("name")
+        intent, text = _intent_and_text(tracker)
+        if not text:
+            return []
         mood = tracker.get_slot("mood")
         support_completed = tracker.get_slot("support_completed")
 
-        # Normalize mood to expected keys
-        if isinstance(mood, str):
-            mood_key = mood.lower()
-        else:
-            mood_key = None
+        # Normalize mood to expected keys. The actions store the slot already
+        # normalized, so the common case is a single set lookup.
+        mood_key = mood if mood in _MOOD_KEYS else (mood.lower() if isinstance(mood, str) else None)
 
         # Fallback to intent name if slot missing
         if not mood_key:
-            intent_name = intent
-            if intent_name == "mood_happy":
-                mood_key = "happy"
-            elif intent_name == "mood_sad":
-                mood_key = "sad"
-            elif intent_name == "mood_angry":
-                mood_key = "angry"
-
-        # Map mood to utterances
-        utter_mapping = {
-            "happy": "utter_reflect_mood_happy",
-            "sad": "utter_reflect_mood_sad",
-            "angry": "utter_reflect_mood_angry",
-        }
+            mood_key = _INTENT_TO_MOOD.get(intent)
+
+        support_completed = bool(support_completed)
+        utter_name = _REFLECT_TABLE.get((support_completed, mood_key))
+        if not utter_name:
+            # If we couldn't resolve the mood, ask for clarification
+            logger.debug("[action_start_reflect_flow] could not resolve mood")
+            dispatcher.utter_message(text="I didn't catch that — can you tell me how you feel?")
+            return []
 
-        # If we just completed the support flow, acknowledge the new mood and end.
-        if support_completed and mood_key in utter_mapping:
-            followup_mapping = {
-                "happy": "utter_followup_mood_happy",
-                "sad": "utter_followup_mood_sad",
-                "angry": "utter_followup_mood_angry",
-            }
-            utter_name = followup_mapping.get(mood_key)
-            if utter_name:
-                dispatcher.utter_message(response=utter_name)
-                if mood_key in ["sad", "angry"]:
-                    dispatcher.utter_message(response="utter_reason_why_you_feel_upset_question")
-                return [
-                    SlotSet("support_completed", None),
-                    SlotSet("mood", mood_key),
-                    SlotSet("last_mood", mood_key),
-                ]
+        # Store the normalized mood and a preserved copy in last_mood, skipping
+        # slots that already hold that value.
+        mood_events = []
+        if mood != mood_key:
+            mood_events.append(SlotSet("mood", mood_key))
+        if tracker.get_slot("last_mood") != mood_key:
+            mood_events.append(SlotSet("last_mood", mood_key))
 
-        utter_name = utter_mapping.get(mood_key)
-
-        if utter_name:
-            print(f"[action_start_reflect_flow] mood_key={mood_key}, sending utter={utter_name}")
-            # Send the reflection utterance
-            dispatcher.utter_message(response=utter_name)
-            # (Optional) additional support message could be sent here
-            # For sad and angry moods, also send the reason question
-            if mood_key in ["sad", "angry"]:
-                dispatcher.utter_message(response="utter_reason_why_you_feel_upset_question")
-            # Ensure mood slot is normalized and store a preserved copy in last_mood
-            return [SlotSet("mood", mood_key), SlotSet("last_mood", mood_key)]
-
-        # If we couldn't resolve the mood, ask for clarification
-        print("[action_start_reflect_flow] could not resolve mood")
-        dispatcher.utter_message(text="I didn't catch that — can you tell me how you feel?")
-        return []
+        logger.debug("[action_start_reflect_flow] mood_key=%s, sending utter=%s", mood_key, utter_name)
+        dispatcher.utter_message(response=utter_name)
+        if support_completed:
+            # The support flow is acknowledged now; don't follow up again.
+            return [SlotSet("support_completed", None), *mood_events]
+        return mood_events
 
 
 class ActionHandleReasonResponse(Action):
     def name(self) -> str:
         return "action_handle_reason_response"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
         domain: Dict[str, Any],
     ) -> List[Dict[str, Any]]:
         """Handle the user's response to 'Do you know what made you feel upset?'"""
-        if not _has_user_text(tracker):
+        intent, text = _intent_and_text(tracker)
+        if not text:
             return []
-        intent = tracker.latest_message.get("intent", {}).get("name")
-        
-        print(f"[action_handle_reason_response] intent={intent}")
+
+        logger.debug("[action_handle_reason_response] intent=%s", intent)
         
         # Only handle deny/affirm intents. For other intents, silently return
         # so the flow can continue or switch to another flow/pattern
         if intent == "deny":
-            # User doesn't know the reason
-            dispatcher.utter_message(response="utter_acknowledge_uneasy_feeling")
-            # Also provide an overview of common reasons in a separate message
-            mood = tracker.get_slot("mood")
-            if mood == "sad":
-                dispatcher.utter_message(response="utter_overview_common_reasons_sad")
-            elif mood == "angry":
-                dispatcher.utter_message(response="utter_overview_common_reasons_angry")
+            # User doesn't know the reason: acknowledge it together with an
+            # overview of common reasons. Falls back to the sad overview if
+            # the mood is unknown.
+            if tracker.get_slot("mood") == "angry":
+                dispatcher.utter_message(response="utter_acknowledge_overview_reasons_angry")
             else:
-                # Fallback to the generic overview if mood is unknown
-                dispatcher.utter_message(response="utter_overview_common_reasons_sad")
+                dispatcher.utter_message(response="utter_acknowledge_overview_reasons_sad")
             return [SlotSet("expect_free_reason", None)]
         elif intent == "affirm":
             # User knows the reason: create space for them to explain it
@@ -170,7 +237,7 @@ class ActionHandlePickReason(Action):
     def name(self) -> str:
         return "action_handle_pick_reason"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -180,9 +247,9 @@ class ActionHandlePickReason(Action):
         If they still don't know (dont_know), send two follow-up messages.
         Otherwise, acknowledge the selected reason.
         """
-        if not _has_user_text(tracker):
+        intent, text = _intent_and_text(tracker)
+        if not text:
             return []
-        intent = tracker.latest_message.get("intent", {}).get("name")
         expect_free_reason = tracker.get_slot("expect_free_reason")
 
         if not expect_free_reason and intent != "pick_reason":
@@ -191,37 +258,29 @@ class ActionHandlePickReason(Action):
 
         reason = tracker.get_slot("reason")
         if not reason:
-            entities = tracker.latest_message.get("entities") or []
-            for entity in entities:
-                if entity.get("entity") == "reason":
-                    reason = entity.get("value")
-                    break
+            entities = tracker.latest_message.get("entities") or ()
+            reason = next((e.get("value") for e in entities if e.get("entity") == "reason"), None)
         if not reason and expect_free_reason:
-            text_reason = (tracker.latest_message.get("text") or "").strip()
-            if text_reason and intent not in ("affirm", "deny"):
-                reason = text_reason
+            if intent not in _AFFIRM_DENY:
+                reason = text
         mood = tracker.get_slot("mood")
-        print(f"[action_handle_pick_reason] intent={intent} reason={reason} mood={mood}")
+        logger.debug("[action_handle_pick_reason] intent=%s reason=%s mood=%s", intent, reason, mood)
 
         # If the user selected or wrote "I don't know" - stop support flow
-        if reason == "dont_know":
+        if reason and reason.replace("’", "'").casefold() in _UNKNOWN_REASONS:
             dispatcher.utter_message(response="utter_reason_unknown_exercise")
             #dispatcher.utter_message(response="utter_reason_unknown_ask_later")
             # Do NOT proceed to the support flow automatically for 'dont_know'.
             # Do not clear the 'mood' slot so we retain the user's emotional state
             # for future commands. Only clear the reason and support_stage.
-            return [
-                SlotSet("reason", None),
-                SlotSet("support_stage", None),
-                SlotSet("expect_free_reason", None),
-            ]
+            return _reset_support_events("expect_free_reason")
 
         # Otherwise, if the user picked (or typed) a reason:
         # - free-text reasons (after "Yes") go to the reframe flow
         # - button-picked reasons go to the support flow
         if reason:
             friendly_reason = self._normalize_reason(reason)
-            log_user_state(tracker.get_slot("mood"), friendly_reason)
+            log_user_state(mood, friendly_reason)
             if expect_free_reason:
                 return [
                     SlotSet("reason", friendly_reason),
@@ -240,25 +299,14 @@ class ActionHandlePickReason(Action):
     @staticmethod
     def _normalize_reason(reason: str) -> str:
         """Turn reason codes into friendlier phrasing for conversation."""
-        mapping = {
-            "tired": "being tired",
-            "missing_someone": "missing someone",
-            "change_in_routine": "something changed at home",
-            "worry_school": "worrying about school",
-            "dont_know": "not sure",
-            "frustration": "feeling frustrated",
-            "someone_bothered_me": "someone upset you",
-            "feeling_ignored": "feeling ignored",
-            "overstimulation": "a noisy or overwhelming place",
-        }
-        return mapping.get(reason, str(reason).replace("_", " "))
+        return _REASON_FRIENDLY.get(reason, str(reason).replace("_", " "))
 
 
 class ActionHandleSupportFlow(Action):
     def name(self) -> str:
         return "action_handle_support_flow"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -268,12 +316,12 @@ class ActionHandleSupportFlow(Action):
            Uses a slot 'support_stage' to track progress. If user answers 'affirm' to continue,
            proceed; if 'deny', stop the flow.
         """
-        if not _has_user_text(tracker):
+        intent, text = _intent_and_text(tracker)
+        if not text:
             return []
         # If we're in the reframing flow, skip support flow to avoid looping.
         if tracker.get_slot("reframe_stage"):
             return []
-        intent = tracker.latest_message.get("intent", {}).get("name")
         stage = tracker.get_slot("support_stage")
         mood = tracker.get_slot("mood")
         reason = tracker.get_slot("reason")
@@ -281,35 +329,22 @@ class ActionHandleSupportFlow(Action):
 
         # Allow off-path intents to interrupt the support flow gracefully.
         if intent == "play_riddle":
-            return [
-                SlotSet("support_stage", None),
-                SlotSet("reason", None),
-                SlotSet("expect_free_reason", None),
-                FollowupAction("action_fetch_riddle"),
-            ]
+            return [*_reset_support_events("expect_free_reason"), FollowupAction("action_fetch_riddle")]
         if intent == "greet":
             dispatcher.utter_message(response="utter_supportive_message")
             dispatcher.utter_message(response="utter_ask_mood_intro")
-            return [
-                SlotSet("support_stage", None),
-                SlotSet("reason", None),
-                SlotSet("expect_free_reason", None),
-            ]
+            return _reset_support_events("expect_free_reason")
 
-        print(f"[action_handle_support_flow] intent={intent} stage={stage} mood={mood} reason={reason}")
+        logger.debug(
+            "[action_handle_support_flow] intent=%s stage=%s mood=%s reason=%s",
+            intent, stage, mood, reason,
+        )
 
         # If a new mood was selected after completion, hand off to reflect flow.
-        if support_completed and intent in ("mood_happy", "mood_sad", "mood_angry"):
-            mood_map = {
-                "mood_happy": "happy",
-                "mood_sad": "sad",
-                "mood_angry": "angry",
-            }
-            next_mood = mood_map.get(intent)
+        if support_completed and intent in _MOOD_INTENTS:
+            next_mood = _INTENT_TO_MOOD.get(intent)
             return [
-                SlotSet("support_stage", None),
-                SlotSet("reason", None),
-                SlotSet("support_completed", None),
+                *_reset_support_events("support_completed"),
                 SlotSet("mood", next_mood),
                 SlotSet("last_mood", next_mood),
                 FollowupAction("action_start_reflect_flow"),
@@ -319,73 +354,37 @@ class ActionHandleSupportFlow(Action):
         if not stage:
             if not reason:
                 return []
-            dispatcher.utter_message(response="utter_stage_common_ground")
-            dispatcher.utter_message(response="utter_stage_continue_question")
+            dispatcher.utter_message(response=_STAGE_TABLE["common_ground"][0])
             return [SlotSet("support_stage", "common_ground")]
 
+        entry = _STAGE_TABLE.get(stage)
+
         # If we have a stage set but the user hasn't replied yes/no yet (e.g. we were invoked
         # as a followup after a reason selection), send the current stage message and wait
         # for the user's affirmation/denial (intent will not be 'affirm' or 'deny').
-        if stage and intent not in ("affirm", "deny"):
-            if stage == "common_ground":
-                dispatcher.utter_message(response="utter_stage_common_ground")
-            elif stage == "acceptance":
-                dispatcher.utter_message(response="utter_stage_acceptance")
-            elif stage == "analysis":
-                dispatcher.utter_message(response="utter_stage_analysis")
-            elif stage == "nuance":
-                dispatcher.utter_message(response="utter_stage_nuance")
-            dispatcher.utter_message(response="utter_stage_continue_question")
-            return [SlotSet("support_stage", stage)]
-
-        # If currently in common_ground and user affirmed, go to acceptance
-        if stage == "common_ground":
-            if intent == "affirm":
-                dispatcher.utter_message(response="utter_stage_acceptance")
-                dispatcher.utter_message(response="utter_stage_continue_question")
-                return [SlotSet("support_stage", "acceptance")]
-            elif intent == "deny":
-                # User doesn't want to continue
-                dispatcher.utter_message(text="No worries — we can pause here. If you want to try later, I’ll be here.")
-                # Keep 'mood' so we remember the user's current emotion for later.
-                return [SlotSet("support_stage", None), SlotSet("reason", None)]
-
-        if stage == "acceptance":
-            if intent == "affirm":
-                dispatcher.utter_message(response="utter_stage_analysis")
-                dispatcher.utter_message(response="utter_stage_continue_question")
-                return [SlotSet("support_stage", "analysis")]
-            elif intent == "deny":
-                dispatcher.utter_message(text="That's okay. We can pause anytime. If you want to continue later, tell me and we can pick it up.")
-                # Keep 'mood' so we remember the user's current emotion for later.
-                return [SlotSet("support_stage", None), SlotSet("reason", None)]
+        if intent not in _AFFIRM_DENY:
+            dispatcher.utter_message(response=entry[0] if entry else "utter_stage_continue_question")
+            # support_stage already holds this value, so there is nothing to set.
+            return []
 
-        if stage == "analysis":
-            if intent == "affirm":
-                dispatcher.utter_message(response="utter_stage_nuance")
-                dispatcher.utter_message(response="utter_stage_continue_question")
-                return [SlotSet("support_stage", "nuance")]
-            elif intent == "deny":
-                dispatcher.utter_message(text="Totally fine — we can stop here for now.")
-                # Keep 'mood' so we remember the user's current emotion for later.
-                return [SlotSet("support_stage", None), SlotSet("reason", None)]
+        if entry is None:
+            return []
+        _, next_stage, pause_text = entry
 
-        if stage == "nuance":
-            if intent == "affirm":
+        if intent == "affirm":
+            if next_stage is None:
                 # Final step done, then check if the mood has shifted.
                 dispatcher.utter_message(response="utter_support_done_check_mood")
-                return [
-                    SlotSet("support_stage", None),
-                    SlotSet("reason", None),
-                    SlotSet("support_completed", True),
-                ]
-            elif intent == "deny":
-                dispatcher.utter_message(text="That’s okay — if you want to keep exploring another time, I’ll be right here.")
-                # Keep 'mood' so we remember the user's current emotion for later.
-                return [SlotSet("support_stage", None), SlotSet("reason", None), SlotSet("last_mood", None), SlotSet("mood", None)]
+                return [*_reset_support_events(), SlotSet("support_completed", True)]
+            dispatcher.utter_message(response=_STAGE_TABLE[next_stage][0])
+            return [SlotSet("support_stage", next_stage)]
 
-        # If none of the above matched, do nothing
-        return []
+        # User doesn't want to continue. Keep 'mood' so we remember the user's
+        # current emotion for later, unless they stopped at the very last step.
+        dispatcher.utter_message(text=pause_text)
+        if next_stage is None:
+            return _reset_support_events("last_mood", "mood")
+        return _reset_support_events()
 
     @staticmethod
     def _suggest_activity(reason: str) -> str:
@@ -407,30 +406,43 @@ class ActionHandleSupportFlow(Action):
         return "Let's ground together: place a hand on your belly, take five slow breaths, and notice one thing you can see, hear, and feel right now."
 
 
+# Upper bound (seconds) on waiting for the LLM before using the static reframe.
+_REFRAME_DEADLINE = 3
+
+# Recent first reframes keyed by (reason, detail), so a conversation that opens
+# on the same reason and detail skips the LLM round-trip. Follow-up reframes
+# (more detail, another angle) always bypass the lookup so the user never sees
+# the same text twice. Only touched from the action server's event loop, so no locking is needed.
+_REFRAME_CACHE: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_REFRAME_CACHE_SIZE = 256
+
+
 class ActionHandleReframeFlow(Action):
     def name(self) -> str:
         return "action_handle_reframe_flow"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
         domain: Dict[str, Any],
     ) -> List[Dict[str, Any]]:
         """Reframe immediately: reflect + alternative suggestion, then offer to continue."""
-        intent = tracker.latest_message.get("intent", {}).get("name")
+        intent, user_text = _intent_and_text(tracker)
         stage = tracker.get_slot("reframe_stage")
         mood = tracker.get_slot("mood") or "this feeling"
         reason = tracker.get_slot("reason") or "this situation"
-        user_text = (tracker.latest_message.get("text") or "").strip()
         detail_slot = tracker.get_slot("reason_detail")
 
-        print(f"[action_handle_reframe_flow] intent={intent} stage={stage} mood={mood} reason={reason} detail={detail_slot}")
+        logger.debug(
+            "[action_handle_reframe_flow] intent=%s stage=%s mood=%s reason=%s detail=%s",
+            intent, stage, mood, reason, detail_slot,
+        )
 
         # Step 1: immediate reframe (no consent question)
         if not stage:
             detail = self._clean_detail(user_text, detail_slot, reason)
-            reframe_text = self._generate_reframe_text(reason, detail)
+            reframe_text = await self._generate_reframe_text(reason, detail)
             dispatcher.utter_message(text=reframe_text)
             dispatcher.utter_message(response="utter_stage_continue_question")
             return [
@@ -441,7 +453,8 @@ class ActionHandleReframeFlow(Action):
         # Step 2: reflect and reframe
         if stage == "reframe":
             detail = self._clean_detail(user_text, detail_slot, reason)
-            reframe_text = self._generate_reframe_text(reason, detail)
+            # The user already saw the reframe for this key; ask for a new one.
+            reframe_text = await self._generate_reframe_text(reason, detail, refresh=True)
             dispatcher.utter_message(text=reframe_text)
             dispatcher.utter_message(response="utter_stage_continue_question")
             return [SlotSet("reframe_stage", "wrap"), SlotSet("reason_detail", detail)]
@@ -461,7 +474,7 @@ class ActionHandleReframeFlow(Action):
                 ]
             if intent == "deny":
                 detail = self._clean_detail(user_text, detail_slot, reason)
-                alt_text = self._generate_reframe_text(reason, detail)
+                alt_text = await self._generate_reframe_text(reason, detail, refresh=True)
                 dispatcher.utter_message(text="Let's try another angle.")
                 dispatcher.utter_message(text=alt_text)
                 dispatcher.utter_message(response="utter_stage_continue_question")
@@ -492,46 +505,105 @@ class ActionHandleReframeFlow(Action):
         return text.replace("_", " ")
 
     @staticmethod
-    def _generate_reframe_text(reason: str, detail: str) -> str:
+    async def _generate_reframe_text(reason: str, detail: str, refresh: bool = False) -> str:
         """Generate a dynamic reframe with LLM; fall back to static suggestion."""
-        fallback = ActionHandleSupportFlow._suggest_activity(reason)
-        if not litellm:
-            return fallback
-        prompt = (
-            "You are a brief, supportive coach. Reframe the situation to reduce distress "
-            "and suggest one concrete, calming next step. Keep it to 2 short sentences. "
-            f"Reason: {reason}. Detail: {detail or reason}."
-        )
-        try:
-            resp = litellm.completion(
+        text = await _cached_llm_reframe(reason, detail, refresh=refresh)
+        return text or ActionHandleSupportFlow._suggest_activity(reason)
+
+
+async def _llm_reframe(reason: str, detail: str) -> Optional[str]:
+    if not litellm:
+        return None
+    prompt = (
+        "You are a brief, supportive coach. Reframe the situation to reduce distress "
+        "and suggest one concrete, calming next step. Keep it to 2 short sentences. "
+        f"Reason: {reason}. Detail: {detail or reason}."
+    )
+    try:
+        resp = await asyncio.wait_for(
+            litellm.acompletion(
                 model="gemini/gemini-pro",
                 messages=[{"role": "user", "content": prompt}],
                 api_key=os.getenv("GEMINI_API_KEY"),
-                timeout=10,
-            )
-            text = resp.choices[0].message["content"]
-            return text.strip() if text else fallback
-        except Exception as e:  # pragma: no cover
-            print(f"[action_handle_reframe_flow] llm fallback due to error: {e}")
-            return fallback
+                timeout=5,
+            ),
+            timeout=_REFRAME_DEADLINE,
+        )
+        text = resp.choices[0].message["content"]
+        return text.strip() if text else None
+    except Exception as e:  # pragma: no cover
+        logger.warning("[action_handle_reframe_flow] llm fallback due to error: %s", e)
+        return None
+
+
+async def _cached_llm_reframe(reason: str, detail: str, refresh: bool = False) -> Optional[str]:
+    """LRU-cached LLM reframe keyed by (reason, detail); failures are not cached.
+
+    ``refresh`` skips the lookup (the user added detail or asked for another
+    angle, so replaying the cached text would repeat what they just saw) but
+    still stores the new answer.
+    """
+    key = (reason, detail)
+    if not refresh:
+        cached = _REFRAME_CACHE.get(key)
+        if cached is not None:
+            _REFRAME_CACHE.move_to_end(key)
+            return cached
+    text = await _llm_reframe(reason, detail)
+    if text:
+        _REFRAME_CACHE[key] = text
+        _REFRAME_CACHE.move_to_end(key)
+        if len(_REFRAME_CACHE) > _REFRAME_CACHE_SIZE:
+            _REFRAME_CACHE.popitem(last=False)
+    return text
 
 
-def log_user_state(mood: Any, reason: Any) -> None:
-    """Append mood/reason selections to a local text log for simple traceability."""
+class _UtcIsoFormatter(logging.Formatter):
+    """Timestamp records like datetime.utcnow().isoformat(), microseconds included."""
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        return datetime.fromtimestamp(record.created, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+def _build_state_logger() -> logging.Logger:
+    """Route user-state records through a queue to a background file writer."""
+    state_logger = logging.getLogger("user_state")
+    state_logger.setLevel(logging.INFO)
+    state_logger.propagate = False
     try:
         os.makedirs("logs", exist_ok=True)
-        ts = datetime.utcnow().isoformat()
-        with open("logs/user_state.log", "a", encoding="utf-8") as f:
-            f.write(f"{ts}\tmood={mood or ''}\treason={reason or ''}\n")
+        file_handler = RotatingFileHandler(
+            "logs/user_state.log", maxBytes=1 << 20, backupCount=3, encoding="utf-8", delay=True
+        )
+        file_handler.setFormatter(_UtcIsoFormatter("%(asctime)s\t%(message)s"))
+
+        log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+        listener = QueueListener(log_queue, file_handler)
+        listener.start()
+        atexit.register(listener.stop)
     except Exception as e:
-        print(f"[log_user_state] failed to write log: {e}")
+        # The log is for traceability only; never keep the action server from starting.
+        logger.warning("[log_user_state] user state logging disabled: %s", e)
+        state_logger.addHandler(logging.NullHandler())
+        return state_logger
+
+    state_logger.addHandler(QueueHandler(log_queue))
+    return state_logger
+
+
+_state_logger = _build_state_logger()
+
+
+def log_user_state(mood: Any, reason: Any) -> None:
+    """Append mood/reason selections to a local text log for simple traceability."""
+    _state_logger.info("mood=%s\treason=%s", mood or "", reason or "")
 
 
 class ActionGetStoredMood(Action):
     def name(self) -> str:
         return "action_get_stored_mood"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -556,18 +628,16 @@ class ActionRestartConversation(Action):
         dispatcher.utter_message(response="utter_restart_ok")
 
         # Restart clears the conversation state (including slots) back to the start.
-        # Then we immediately start your reflect/mood flow again.
-        return [
-            Restarted(),
-            FollowupAction("action_start_reflect_flow"),
-        ]
+        # No follow-up into the reflect flow: on the restarted tracker there is no
+        # user message or mood yet, so it would return without doing anything.
+        return [Restarted()]
 
 
 class ActionRestartToGreeting(Action):
     def name(self) -> str:
         return "action_restart_to_greeting"
 
-    def run(self, dispatcher, tracker, domain):
+    async def run(self, dispatcher, tracker, domain):
         if not _has_user_text(tracker):
             return []
         return [
@@ -582,7 +652,7 @@ class ActionClearSupportState(Action):
     def name(self) -> str:
         return "action_clear_support_state"
 
-    def run(self, dispatcher, tracker, domain):
+    async def run(self, dispatcher, tracker, domain):
         if not _has_user_text(tracker):
             return []
         return [
@@ -598,56 +668,154 @@ class ActionClearSupportState(Action):
 
 
 
+_RIDDLE_URL = "https://api.api-ninjas.com/v1/riddles"
+_RIDDLE_API_KEY = os.getenv("API_NINJAS_KEY")
+
+# requests.Session is not thread-safe, so each thread (the producer and the
+# to_thread workers) keeps its own pooled session.
+_RIDDLE_SESSIONS = threading.local()
+
+# Buffer of pre-fetched riddles, kept full by a background producer thread.
+_RIDDLE_QUEUE: "queue.Queue[Dict[Text, Any]]" = queue.Queue(maxsize=5)
+_RIDDLE_RETRY_DELAY = 30
+_RIDDLE_PRODUCER: Optional[threading.Thread] = None
+_RIDDLE_PRODUCER_LOCK = threading.Lock()
+
+
+def _riddle_session() -> requests.Session:
+    session = getattr(_RIDDLE_SESSIONS, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        _RIDDLE_SESSIONS.session = session
+    return session
+
+
+def _request_riddles(api_key: str) -> Any:
+    response = _riddle_session().get(
+        _RIDDLE_URL,
+        headers={"X-Api-Key": api_key},
+        timeout=8,
+    )
+    response.raise_for_status()
+    if orjson:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+def _riddle_producer() -> None:
+    """Keep the riddle buffer topped up so fetches rarely wait on the network."""
+    while True:
+        try:
+            data = _request_riddles(_RIDDLE_API_KEY)
+            riddles = [
+                riddle
+                for riddle in (data if isinstance(data, list) else [])
+                if isinstance(riddle, dict) and riddle.get("question") and riddle.get("answer")
+            ]
+        except (requests.RequestException, ValueError):
+            riddles = []
+        except Exception:
+            # Anything unexpected must not silently kill the producer thread.
+            logger.exception("[riddle_producer] unexpected error while prefetching riddles")
+            riddles = []
+        if not riddles:
+            # Service unavailable or returned junk; back off before retrying.
+            time.sleep(_RIDDLE_RETRY_DELAY)
+            continue
+        for riddle in riddles:
+            _RIDDLE_QUEUE.put(riddle)
+
+
+def _ensure_riddle_producer() -> None:
+    """Start the prefetch thread the first time a riddle is requested."""
+    global _RIDDLE_PRODUCER
+    with _RIDDLE_PRODUCER_LOCK:
+        if _RIDDLE_PRODUCER is None:
+            _RIDDLE_PRODUCER = threading.Thread(
+                target=_riddle_producer, name="riddle-prefetch", daemon=True
+            )
+            _RIDDLE_PRODUCER.start()
+
+
+_RIDDLE_STRIP = re.compile(r"[^a-z0-9]+")
+_RIDDLE_TOK = re.compile(r"[a-z0-9]+")
+
+# Filler words ignored when comparing a guess against the riddle answer.
+_STOP_WORDS = frozenset({
+    "a",
+    "an",
+    "the",
+    "my",
+    "your",
+    "everyone",
+    "everybody",
+    "has",
+    "have",
+    "one",
+    "is",
+    "are",
+    "its",
+    "it's",
+    "to",
+    "of",
+})
+
+
 def _normalize_riddle_text(text: str) -> str:
     if not text:
         return ""
-    text = text.lower().strip()
-    text = re.sub(r"[^a-z0-9]+", "", text)
-    return text
+    return _RIDDLE_STRIP.sub("", text.lower().strip())
 
 
 def _tokenize_riddle_text(text: str) -> List[str]:
     if not text:
         return []
-    return re.findall(r"[a-z0-9]+", text.lower())
+    return _RIDDLE_TOK.findall(text.lower())
+
+
+def _core_riddle_tokens(text: str) -> List[str]:
+    return [token for token in _tokenize_riddle_text(text) if token not in _STOP_WORDS]
 
 
 class ActionFetchRiddle(Action):
     def name(self) -> Text:
         return "action_fetch_riddle"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
         domain: Dict[Text, Any],
     ) -> List[Dict[Text, Any]]:
-        api_key = os.getenv("API_NINJAS_KEY")
+        api_key = _RIDDLE_API_KEY
         if not api_key:
             dispatcher.utter_message(text="Riddle API key is missing on the server.")
             return []
 
+        _ensure_riddle_producer()
         try:
-            response = requests.get(
-                "https://api.api-ninjas.com/v1/riddles",
-                headers={"X-Api-Key": api_key},
-                timeout=8,
-            )
-            response.raise_for_status()
-            data = response.json()
-        except requests.RequestException:
-            dispatcher.utter_message(
-                text="I couldn't reach the riddle service right now. Try again later."
-            )
-            return []
+            riddle = _RIDDLE_QUEUE.get_nowait()
+        except queue.Empty:
+            # Buffer drained (or producer not running): fetch synchronously.
+            try:
+                data = await asyncio.to_thread(_request_riddles, api_key)
+            except (requests.RequestException, ValueError):
+                dispatcher.utter_message(
+                    text="I couldn't reach the riddle service right now. Try again later."
+                )
+                return []
 
-        if not data or not isinstance(data, list):
-            dispatcher.utter_message(
-                text="I didn't get a valid riddle back. Try again."
-            )
-            return []
+            if not data or not isinstance(data, list):
+                dispatcher.utter_message(
+                    text="I didn't get a valid riddle back. Try again."
+                )
+                return []
+
+            riddle = data[0]
+            if not isinstance(riddle, dict):
+                riddle = {}
 
-        riddle = data[0] if data else {}
         question = riddle.get("question")
         answer = riddle.get("answer")
 
@@ -659,9 +827,16 @@ class ActionFetchRiddle(Action):
 
         dispatcher.utter_message(text=f"Certainly! Here's your riddle:\n\n{question}")
 
+        # The answer is fixed for the whole riddle, so normalize it once here
+        # instead of on every guess.
+        answer_norm = _normalize_riddle_text(answer)
+        answer_core = frozenset(_core_riddle_tokens(answer))
+
         return [
             SlotSet("riddle_question", question),
             SlotSet("riddle_answer", answer),
+            SlotSet("riddle_answer_norm", answer_norm),
+            SlotSet("riddle_answer_core", sorted(answer_core)),
             SlotSet("riddle_attempts", 0),
             SlotSet("guess", None),
             SlotSet("riddle_trigger_text", tracker.latest_message.get("text")),
@@ -673,17 +848,16 @@ class ValidateRiddleForm(FormValidationAction):
     def name(self) -> Text:
         return "validate_riddle_form"
 
-    def extract_guess(
+    async def extract_guess(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
         domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
-        intent = tracker.latest_message.get("intent", {}).get("name")
+        intent, text = _intent_and_text(tracker)
         if intent == "play_riddle":
             return {}
 
-        text = (tracker.latest_message.get("text") or "").strip()
         if not text:
             return {}
 
@@ -692,17 +866,18 @@ class ValidateRiddleForm(FormValidationAction):
 
         return {"guess": text}
 
-    def validate_guess(
+    async def validate_guess(
         self,
         value: Text,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
         domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
-        trigger_text = (tracker.get_slot("riddle_trigger_text") or "").strip()
-        if not value or not value.strip():
+        guess = (value or "").strip()
+        if not guess:
             return {"guess": None}
-        if trigger_text and value.strip() == trigger_text:
+        trigger_text = (tracker.get_slot("riddle_trigger_text") or "").strip()
+        if trigger_text and guess == trigger_text:
             return {"guess": None}
 
         answer = tracker.get_slot("riddle_answer") or ""
@@ -711,38 +886,24 @@ class ValidateRiddleForm(FormValidationAction):
         attempts = int(attempts) + 1
 
         user_guess_norm = _normalize_riddle_text(value)
-        answer_norm = _normalize_riddle_text(answer)
-        user_tokens = _tokenize_riddle_text(value)
-        answer_tokens = _tokenize_riddle_text(answer)
-
-        stop_words = {
-            "a",
-            "an",
-            "the",
-            "my",
-            "your",
-            "everyone",
-            "everybody",
-            "has",
-            "have",
-            "one",
-            "is",
-            "are",
-            "its",
-            "it's",
-            "to",
-            "of",
-        }
-        user_core = [token for token in user_tokens if token not in stop_words]
-        answer_core = [token for token in answer_tokens if token not in stop_words]
-
-        exact_match = user_guess_norm and answer_norm and user_guess_norm == answer_norm
-        substring_match = user_guess_norm and answer_norm and (
-            user_guess_norm in answer_norm or answer_norm in user_guess_norm
-        )
-        core_match = bool(user_core) and bool(answer_core) and (
-            user_core == answer_core or set(user_core) == set(answer_core)
+        user_core_set = set(_core_riddle_tokens(value))
+
+        answer_norm = tracker.get_slot("riddle_answer_norm")
+        if answer_norm is None:
+            answer_norm = _normalize_riddle_text(answer)
+        answer_core = tracker.get_slot("riddle_answer_core")
+        if answer_core is None:
+            answer_core = _core_riddle_tokens(answer)
+        answer_core_set = frozenset(answer_core)
+
+        exact_match = bool(user_guess_norm) and bool(answer_norm) and user_guess_norm == answer_norm
+        substring_match = (
+            not exact_match
+            and bool(user_guess_norm)
+            and bool(answer_norm)
+            and (user_guess_norm in answer_norm or answer_norm in user_guess_norm)
         )
+        core_match = bool(user_core_set) and user_core_set == answer_core_set
 
         if exact_match or substring_match or core_match:
             dispatcher.utter_message(text="Yes! That's correct.")
@@ -751,6 +912,8 @@ class ValidateRiddleForm(FormValidationAction):
                 "requested_slot": None,
                 "riddle_question": None,
                 "riddle_answer": None,
+                "riddle_answer_norm": None,
+                "riddle_answer_core": None,
                 "riddle_attempts": None,
                 "riddle_trigger_text": None,
             }
@@ -768,6 +931,8 @@ class ValidateRiddleForm(FormValidationAction):
             "requested_slot": None,
             "riddle_question": None,
             "riddle_answer": None,
+            "riddle_answer_norm": None,
+            "riddle_answer_core": None,
             "riddle_attempts": None,
             "riddle_trigger_text": None,
         }
@@ -777,7 +942,7 @@ class ActionResetRiddle(Action):
     def name(self) -> Text:
         return "action_reset_riddle"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -786,6 +951,8 @@ class ActionResetRiddle(Action):
         return [
             SlotSet("riddle_question", None),
             SlotSet("riddle_answer", None),
+            SlotSet("riddle_answer_norm", None),
+            SlotSet("riddle_answer_core", None),
             SlotSet("riddle_attempts", None),
             SlotSet("guess", None),
             SlotSet("riddle_trigger_text", None),
@@ -796,7 +963,7 @@ class ActionGenerateRapport(Action):
     def name(self) -> Text:
         return "action_generate_rapport"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -829,17 +996,11 @@ class ActionGenerateRapport(Action):
             "validation and gentle coping steps remain important."
         )
 
-        ts = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
-        logs_dir = Path("logs")
-        logs_dir.mkdir(exist_ok=True)
-        file_path = logs_dir / f"rapport_{ts}.txt"
+        ts = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        file_path = Path("logs") / f"rapport_{ts}.txt"
 
         try:
-            with file_path.open("w", encoding="utf-8") as f:
-                f.write("Conversation transcript:\n")
-                f.write("\n".join(transcript_lines))
-                f.write("\n\nRapport/explanation:\n")
-                f.write(explanation)
+            await asyncio.to_thread(self._write_rapport, file_path, transcript_lines, explanation)
             dispatcher.utter_message(
                 text=f"I saved a conversation summary and rapport to {file_path}. "
                      "It includes the transcript and a brief explanation of the feelings."
@@ -848,3 +1009,12 @@ class ActionGenerateRapport(Action):
             dispatcher.utter_message(text=f"I couldn't save the rapport file ({e}).")
 
         return []
+
+    @staticmethod
+    def _write_rapport(file_path: Path, transcript_lines: List[str], explanation: str) -> None:
+        file_path.parent.mkdir(exist_ok=True)
+        with file_path.open("w", encoding="utf-8") as f:
+            f.write("Conversation transcript:\n")
+            f.write("\n".join(transcript_lines))
+            f.write("\n\nRapport/explanation:\n")
+            f.write(explanation)
@@ -4,7 +4,7 @@ import requests
 import logging
 from flask import Flask, send_from_directory, request, jsonify
 from flask_cors import CORS
-from requests.exceptions import RequestException, Timeout, ConnectionError
+from requests.exceptions import RequestException
 
 # Setup logging
 logging.basicConfig(level=logging.INFO,
@@ -38,7 +38,7 @@ def check_rasa():
         else:
             return jsonify({"status": "unavailable", "reason": "API responded with error"}), 503
     except RequestException as e:
-        logger.error(f"Failed to connect to Rasa server: {str(e)}")
+        logger.error("Failed to connect to Rasa server: %s", e)
         return jsonify({"status": "unavailable", "reason": str(e)}), 503
 
 
@@ -112,7 +112,7 @@ def process_rasa_response(response, original_context):
                     custom_data = json.loads(custom_data)
                 except json.JSONDecodeError:
                     logger.warning(
-                        f"Failed to decode custom JSON: {custom_data}")
+                        "Failed to decode custom JSON: %s", custom_data)
                     continue
 
             if custom_data.get("action"):
@@ -135,7 +135,7 @@ def process_rasa_response(response, original_context):
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 3000))
-    logger.info(f"Chatbot server running on http://localhost:{port}")
+    logger.info("Chatbot server running on http://localhost:%s", port)
     logger.info("To use with Rasa, make sure to start the Rasa server with:")
     logger.info("  - rasa run --enable-api --cors \"*\"")
     app.run(debug=True, port=port)
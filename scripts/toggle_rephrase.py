@@ -1,65 +1,42 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import re
 from pathlib import Path
 
+_TRUTHY = frozenset({"1", "true", "yes", "y", "on"})
+
+# Top-level `nlg:` key plus its indented body and any trailing blank lines.
+_NLG_RE = re.compile(rb"(?m)^nlg:.*\n(?:(?:  .*|[ \t\r]*)\n)*")
+# Top-level `action_endpoint:` key, its indented body and one separating blank line.
+_ACTION_ENDPOINT_RE = re.compile(rb"(?m)^action_endpoint:.*\n(?:  .*\n)*(?:[ \t\r]*\n)?")
+
 
 def _read_env_flag(env_path: Path, key: str) -> bool:
     if not env_path.exists():
         return False
-    for line in env_path.read_text().splitlines():
-        line = line.strip()
-        if not line or line.startswith("#") or "=" not in line:
-            continue
-        k, v = line.split("=", 1)
-        if k.strip() == key:
-            return v.strip().lower() in ("1", "true", "yes", "y", "on")
-    return False
+    match = re.search(rf"(?m)^[ \t]*{re.escape(key)}[ \t]*=(.*)$", env_path.read_text())
+    if not match:
+        return False
+    return match.group(1).strip().lower() in _TRUTHY
 
 
-def _remove_nlg_block(lines: list[str]) -> list[str]:
-    new_lines: list[str] = []
-    idx = 0
-    while idx < len(lines):
-        line = lines[idx]
-        if line.startswith("nlg:"):
-            idx += 1
-            while idx < len(lines) and (lines[idx].startswith("  ") or not lines[idx].strip()):
-                idx += 1
-            continue
-        new_lines.append(line)
-        idx += 1
-    return new_lines
+def _remove_nlg_block(raw: bytes) -> bytes:
+    return _NLG_RE.sub(b"", raw)
 
 
-def _insert_nlg_block(lines: list[str], model_group: str) -> list[str]:
-    nlg_block = [
-        "nlg:",
-        "  type: rephrase",
-        "  llm:",
-        f"    model_group: {model_group}",
-        "",
-    ]
-    new_lines: list[str] = []
-    inserted = False
-    idx = 0
-    while idx < len(lines):
-        line = lines[idx]
-        new_lines.append(line)
-        if not inserted and line.startswith("action_endpoint:"):
-            idx += 1
-            while idx < len(lines):
-                new_lines.append(lines[idx])
-                if not lines[idx].startswith("  "):
-                    break
-                idx += 1
-            new_lines.extend(nlg_block)
-            inserted = True
-            continue
-        idx += 1
+def _insert_nlg_block(raw: bytes, model_group: str) -> bytes:
+    nlg_block = (
+        "nlg:\n"
+        "  type: rephrase\n"
+        "  llm:\n"
+        f"    model_group: {model_group}\n"
+        "\n"
+    ).encode()
+    raw, inserted = _ACTION_ENDPOINT_RE.subn(lambda m: m.group(0) + nlg_block, raw, count=1)
     if not inserted:
-        new_lines = nlg_block + new_lines
-    return new_lines
+        raw = nlg_block + raw
+    return raw
 
 
 def main() -> None:
@@ -69,11 +46,16 @@ def main() -> None:
     enabled = _read_env_flag(env_path, "ENABLE_REPHRASE")
     model_group = "gemini_command_generation_model"
 
-    lines = endpoints_path.read_text().splitlines()
-    lines = _remove_nlg_block(lines)
+    # Work on raw bytes: the edit is ASCII-only, so there is no need to decode.
+    original = endpoints_path.read_bytes()
+    raw = original if original.endswith(b"\n") else original + b"\n"
+    raw = _remove_nlg_block(raw)
     if enabled:
-        lines = _insert_nlg_block(lines, model_group)
-    endpoints_path.write_text("\n".join(lines) + "\n")
+        raw = _insert_nlg_block(raw, model_group)
+    # Leave the file untouched when nothing changed, so file watchers
+    # (e.g. a reloading rasa server) aren't triggered needlessly.
+    if raw != original:
+        endpoints_path.write_bytes(raw)
 
     state = "enabled" if enabled else "disabled"
     print(f"Rephrase NLG {state}.")